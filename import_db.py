@@ -1,12 +1,22 @@
 import os
 import re
 import sys
+import time
 
 import MySQLdb
 from decouple import config
 from pandas import read_excel
 
 MAX_FLASH = 100
+PROGRESS_EVERY = 1000
+
+
+class ImportCancelled(Exception):
+    """raised by a progress callback to stop a running import"""
+
+
+def _no_progress(phase, done, total):
+    pass
 
 
 def _remove_non_alphanum_char(string):
@@ -54,7 +64,33 @@ def get_database_connection():
     )
 
 
-def import_database_from_excel(filepath):
+def _set_log(cur, log_name, log_value):
+    """writes one value into the logs table, replacing the old one"""
+    cur.execute(
+        """INSERT INTO logs VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE log_value = VALUES(log_value)""",
+        (log_name, log_value),
+    )
+
+
+def _create_logs_table(cur):
+    """creates the logs table keyed on log_name. a logs table from before
+    the key existed is recreated once"""
+    cur.execute("SHOW TABLES LIKE 'logs'")
+    if cur.fetchone():
+        cur.execute("SHOW KEYS FROM logs WHERE Key_name = 'PRIMARY'")
+        if cur.fetchone():
+            return
+        cur.execute("DROP TABLE logs;")
+    cur.execute(
+        """CREATE TABLE logs (
+        log_name CHAR(200) PRIMARY KEY,
+        log_value MEDIUMTEXT);
+        """
+    )
+
+
+def import_database_from_excel(filepath, progress=_no_progress):
     """gets an excel file name and imports lookup data (data and failures) from it
     the first (0) sheet contains serial data like:
      Row	Reference Number	Description	Start Serial	End Serial	Date
@@ -64,6 +100,11 @@ def import_database_from_excel(filepath):
     in two tables. "serials" and "invalids"
 
     returns two integers: (number of serial rows, number of invalid rows)
+
+    progress(phase, done, total) is called every PROGRESS_EVERY rows and may
+    raise ImportCancelled to stop the import. rows are loaded into staging
+    tables which replace the live ones only when everything is read, so a
+    cancelled or failed import leaves the old data in place.
     """
     # df contains lookup data in the form of
     # Row	Reference Number	Description	Start Serial	End Serial	Date
@@ -72,29 +113,18 @@ def import_database_from_excel(filepath):
 
     cur = db.cursor()
 
-    total_flashes = 0
     output = []
 
-    try:
-        cur.execute("DROP TABLE IF EXISTS logs;")
-        cur.execute(
-            """CREATE TABLE logs (
-            log_name CHAR(200),
-            log_value MEDIUMTEXT);
-            """
-        )
-        db.commit()
-    except Exception as e:
-        print("dropping logs")
-        output.append(
-            f"problem dropping and creating new table for logs in database; {e}"
-        )
+    _create_logs_table(cur)
+    _set_log(cur, "import", "Import started. logs will appear when its done")
+    db.commit()
 
-    # remove the serials table if exists, then create the new one
+    # the new data goes into staging tables. the live serials and invalids
+    # keep answering lookups until they are swapped at the end
     try:
-        cur.execute("DROP TABLE IF EXISTS serials;")
+        cur.execute("DROP TABLE IF EXISTS serials_staging;")
         cur.execute(
-            """CREATE TABLE serials (
+            """CREATE TABLE serials_staging (
             id INTEGER PRIMARY KEY,
             ref VARCHAR(200),
             description VARCHAR(200),
@@ -111,32 +141,59 @@ def import_database_from_excel(filepath):
             f"problem dropping and creating new table serials in database; {e}"
         )
 
-    cur.execute("INSERT INTO logs VALUES ('db_filename', %s)", (filepath,))
-    db.commit()
-
-    # remove the invalid table if exists, then create the new one
     try:
-        cur.execute("DROP TABLE IF EXISTS invalids;")
+        cur.execute("DROP TABLE IF EXISTS invalids_staging;")
         cur.execute(
-            """CREATE TABLE invalids (
+            """CREATE TABLE invalids_staging (
             invalid_serial CHAR(30), INDEX(invalid_serial));"""
         )
         db.commit()
     except Exception as e:
         output.append(f"Error dropping and creating INVALIDS table; {e}")
 
-    # insert some place holder logs
-    cur.execute(
-        "INSERT INTO logs VALUES ('import', %s)",
-        ("Import started. logs will appear when its done",),
-    )
+    try:
+        serials_counter, invalid_counter = _fill_staging_tables(
+            db, cur, filepath, progress, output
+        )
+    except BaseException:
+        # cancelled or failed: the live tables were never touched
+        cur.execute("DROP TABLE IF EXISTS serials_staging, invalids_staging;")
+        db.commit()
+        db.close()
+        raise
+
+    cur.execute("CREATE TABLE IF NOT EXISTS serials LIKE serials_staging;")
+    cur.execute("CREATE TABLE IF NOT EXISTS invalids LIKE invalids_staging;")
+    cur.execute("DROP TABLE IF EXISTS serials_old, invalids_old;")
     cur.execute(
-        "INSERT INTO logs VALUES ('db_check', %s)",
-        ("DB check will be run after the insert is finished",),
+        """RENAME TABLE serials TO serials_old, serials_staging TO serials,
+        invalids TO invalids_old, invalids_staging TO invalids;"""
     )
+    cur.execute("DROP TABLE serials_old, invalids_old;")
+
+    # save the logs
+    output.append(f"Inserted {serials_counter} serials and {invalid_counter} invalids")
+    output.reverse()
+    _set_log(cur, "import", "\n".join(output))
+    _set_log(cur, "db_filename", filepath)
+    _set_log(cur, "db_check", "DB check will be run after the insert is finished")
+    # replicas serve lookups only once they have caught up to this generation
+    _set_log(cur, "generation", int(time.time()))
     db.commit()
 
+    db.close()
+
+    return
+
+
+def _fill_staging_tables(db, cur, filepath, progress, output):
+    """reads both sheets of the excel file into serials_staging and
+    invalids_staging. returns (serials counter, invalids counter)"""
+    total_flashes = 0
+
+    progress("reading serials", 0, 0)
     df = read_excel(filepath, 0)
+    progress("serials", 0, len(df))
     serials_counter = 1
     line_number = 1
 
@@ -161,7 +218,7 @@ def import_database_from_excel(filepath):
             start_serial = normalize_string(start_serial)
             end_serial = normalize_string(end_serial)
             cur.execute(
-                "INSERT INTO serials VALUES (%s, %s, %s, %s, %s, %s, %s, %s);",
+                "INSERT INTO serials_staging VALUES (%s, %s, %s, %s, %s, %s, %s, %s);",
                 (line, ref, description, start_serial, end_serial, date, text1, text2),
             )
             serials_counter += 1
@@ -180,18 +237,23 @@ def import_database_from_excel(filepath):
                 output.append(
                     f"Problem commiting serials into db at around record {line_number} (or previous 1000 ones); {e}"
                 )
+        if line_number % PROGRESS_EVERY == 0:
+            progress("serials", line_number - 1, len(df))
     db.commit()
+    progress("serials", len(df), len(df))
 
     # now lets save the invalid serials.
 
     invalid_counter = 1
     line_number = 1
+    progress("reading invalids", 0, 0)
     df = read_excel(filepath, 1)
+    progress("invalids", 0, len(df))
     for _, (failed_serial,) in df.iterrows():
         line_number += 1
         try:
             failed_serial = normalize_string(failed_serial)
-            cur.execute("INSERT INTO invalids VALUES (%s);", (failed_serial,))
+            cur.execute("INSERT INTO invalids_staging VALUES (%s);", (failed_serial,))
             invalid_counter += 1
         except Exception as e:
             total_flashes += 1
@@ -209,31 +271,25 @@ def import_database_from_excel(filepath):
                 output.append(
                     f"Problem commiting invalid serials into db at around record {line_number} (or previous 1000 ones); {e}"
                 )
+        if line_number % PROGRESS_EVERY == 0:
+            progress("invalids", line_number - 1, len(df))
     db.commit()
+    progress("invalids", len(df), len(df))
 
-    # save the logs
-    output.append(f"Inserted {serials_counter} serials and {invalid_counter} invalids")
-    output.reverse()
-    cur.execute(
-        "UPDATE logs SET log_value = %s WHERE log_name = 'import'", ("\n".join(output),)
-    )
-    db.commit()
-
-    db.close()
-
-    return
+    return serials_counter, invalid_counter
 
 
-def db_check():
-    """will do some sanity checks on the db and will flash the errors"""
+def db_check(progress=_no_progress):
+    """will do some sanity checks on the db and will flash the errors
+    progress is called like in import_database_from_excel()"""
 
     db = get_database_connection()
     cur = db.cursor()
-    cur.execute(
-        "INSERT INTO logs VALUES ('db_check', %s)",
-        ("DB check started... wait for the results. it may take a while",),
+    _set_log(
+        cur, "db_check", "DB check started... wait for the results. it may take a while"
     )
     db.commit()
+    progress("db_check", 0, 0)
 
     def collision(s1, e1, s2, e2):
         if s2 <= s1 <= e2:
@@ -260,6 +316,7 @@ def db_check():
     cur.execute("SELECT id, start_serial, end_serial FROM serials")
 
     raw_data = cur.fetchall()
+    progress("db_check", 0, len(raw_data))
     all_problems = []
 
     data = {}
@@ -280,8 +337,12 @@ def db_check():
             )
 
     flashed = 0
+    checked = 0
     for letters in data:
         for i in range(len(data[letters])):
+            checked += 1
+            if checked % PROGRESS_EVERY == 0:
+                progress("db_check", checked, len(raw_data))
             for j in range(i + 1, len(data[letters])):
                 id_row1, ss1, es1 = data[letters][i]
                 id_row2, ss2, es2 = data[letters][j]
@@ -293,15 +354,17 @@ def db_check():
     all_problems.reverse()
     output = "\n".join(all_problems)
 
-    cur.execute("UPDATE logs SET log_value = %s WHERE log_name = 'db_check'", (output,))
+    _set_log(cur, "db_check", output)
+    progress("db_check", len(raw_data), len(raw_data))
     db.commit()
 
     db.close()
 
 
-filepath = sys.argv[1]
+if __name__ == "__main__":
+    filepath = sys.argv[1]
 
-import_database_from_excel(filepath)
-db_check()
+    import_database_from_excel(filepath)
+    db_check()
 
-os.remove(filepath)
+    os.remove(filepath)
@@ -0,0 +1,388 @@
+"""load test for the KaveNegar callback flow.
+
+starts a mock KaveNegar gateway and the app (pointed at that gateway) on
+localhost, then replays callbacks against /v1/<CALL_BACK_TOKEN>/process with
+a mix of valid, invalid, double and not-found serials sampled from the db.
+at the end it reports throughput, latency percentiles, errors and how many
+sms the gateway was asked to send.
+
+    python load_test.py --rate 50 --duration 60 --concurrency 32
+    python load_test.py --rate 0 --requests 5000 --max-p99 500
+
+the app runs under the werkzeug dev server by default. production runs
+under uWSGI, so for capacity numbers use --server uwsgi (uwsgi must be
+installed, it reads uwsgi.ini) or --target against a real deployment.
+the started app has IMPORT_WORKER off, so it never runs queued imports.
+
+--rate 0 sends as fast as --concurrency allows. otherwise arrivals are
+poisson at --rate per second and latency is counted from the scheduled
+arrival, so queueing inside an overloaded app shows up in the percentiles.
+every callback is logged to PROCESSED_SMS like a real one, so run it
+against a test database. the exit code is 1 when one of --min-throughput,
+--max-p99 or --max-error-rate is not met, so it can be used as a
+regression gate.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import MySQLdb
+import MySQLdb.cursors
+import requests
+from decouple import config
+
+CALL_BACK_TOKEN = config("CALL_BACK_TOKEN")
+SAMPLE_SIZE = 1000
+
+
+def get_database_connection():
+    """connects to the same MySQL database as the app"""
+    return MySQLdb.connect(
+        host=config("MySQL_HOST", default="localhost"),
+        user=config("MySQL_USER", default="root"),
+        passwd=config("MySQL_PASSWORD", default="password"),
+        db=config("MySQL_DB", default="your_database"),
+        charset="utf8",
+    )
+
+
+def sample_serials():
+    """returns {kind: [serials]} for the kinds check_serial answers with"""
+    db = get_database_connection()
+    cur = db.cursor()
+
+    cur.execute(
+        "SELECT start_serial FROM serials ORDER BY RAND() LIMIT %s", (SAMPLE_SIZE,)
+    )
+    ok = [row[0] for row in cur.fetchall()]
+
+    cur.execute(
+        "SELECT invalid_serial FROM invalids ORDER BY RAND() LIMIT %s", (SAMPLE_SIZE,)
+    )
+    failure = [row[0] for row in cur.fetchall()]
+
+    double = sample_doubles(db)
+    db.close()
+
+    # doubles are also found by the plain serials sample, keep them apart
+    doubles = set(double)
+    ok = [serial for serial in ok if serial not in doubles]
+    notfound = [f"ZZ{random.randint(10**6, 10**8)}" for _ in range(SAMPLE_SIZE)]
+
+    return {
+        "OK": [as_typed(serial) for serial in ok],
+        "FAILURE": [as_typed(serial) for serial in failure],
+        "DOUBLE": [as_typed(serial) for serial in double],
+        "NOT-FOUND": notfound,
+    }
+
+
+def as_typed(serial):
+    """turns a stored serial like FA000...0001234567 back into what a customer
+    sends, FA1234567. normalize_string pads it to the same stored value"""
+    return re.sub(r"^([A-Z]*)0+(?=\d)", r"\1", serial)
+
+
+def sample_doubles(db):
+    """start serials that fall inside an earlier range too, so check_serial
+    finds two rows for them. one pass over serials in (start, end) index
+    order, comparing like check_serial does, keeping the furthest end seen"""
+    cur = db.cursor(MySQLdb.cursors.SSCursor)
+    cur.execute("SELECT start_serial, end_serial FROM serials ORDER BY start_serial")
+    double = []
+    furthest_end = None
+    for start_serial, end_serial in cur:
+        if furthest_end is not None and start_serial <= furthest_end:
+            double.append(start_serial)
+            if len(double) >= SAMPLE_SIZE:
+                break
+        if furthest_end is None or end_serial > furthest_end:
+            furthest_end = end_serial
+    cur.close()
+    return double
+
+
+class MockGateway(ThreadingHTTPServer):
+    """answers like the KaveNegar send api and counts the sms it was given"""
+
+    daemon_threads = True
+
+    def __init__(self, port, delay):
+        super().__init__(("127.0.0.1", port), GatewayHandler)
+        self.delay = delay
+        self.sent = 0
+        self.lock = threading.Lock()
+
+
+class GatewayHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.sent += 1
+        body = json.dumps({"return": {"status": 200, "message": "ok"}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_app(port, gateway_url, server):
+    """runs the app in a child process with URL pointed at the mock gateway,
+    under the werkzeug dev server or under uwsgi with the repo's uwsgi.ini"""
+    env = dict(os.environ, URL=gateway_url, IMPORT_WORKER="false")
+    if server == "uwsgi":
+        command = ["uwsgi", "--ini", "uwsgi.ini", "--http", f"127.0.0.1:{port}"]
+    else:
+        command = [
+            sys.executable,
+            "-c",
+            f"import main; main.app.run('127.0.0.1', {port}, threaded=True)",
+        ]
+    app = subprocess.Popen(
+        command,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+    )
+    health_url = f"http://127.0.0.1:{port}/v1/ok"
+    for _ in range(100):
+        if app.poll() is not None:
+            sys.exit("app exited before it was ready")
+        try:
+            if requests.get(health_url, timeout=1).status_code == 200:
+                return app
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.1)
+    app.terminate()
+    sys.exit("app did not answer the health check")
+
+
+class Traffic:
+    """picks callbacks: serial kinds by the --mix weights, senders skewed so
+    a few numbers send most of the sms"""
+
+    def __init__(self, serials, mix, senders):
+        self.serials = {kind: serials[kind] for kind in mix if serials.get(kind)}
+        for kind in mix:
+            if kind not in self.serials:
+                print(f"no {kind} serials in the db, skipping them")
+        if not self.serials:
+            sys.exit("nothing to send")
+        self.kinds = list(self.serials)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.senders = [f"0912{i:07d}" for i in range(senders)]
+        self.sender_weights = [1 / (i + 1) for i in range(senders)]
+
+    def callback(self):
+        kind = random.choices(self.kinds, self.weights)[0]
+        sender = random.choices(self.senders, self.sender_weights)[0]
+        return kind, {"from": sender, "message": random.choice(self.serials[kind])}
+
+
+class Results:
+    """latencies are kept for every request, failed and timed out ones too,
+    so an overloaded app can not look faster by dropping requests"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.error_latencies = []
+        self.errors = Counter()
+        self.kinds = Counter()
+
+    def add(self, kind, latency, error):
+        with self.lock:
+            self.kinds[kind] += 1
+            self.latencies.append(latency)
+            if error:
+                self.errors[error] += 1
+                self.error_latencies.append(latency)
+
+
+def send_callback(session, url, traffic, results, scheduled):
+    kind, data = traffic.callback()
+    error = None
+    try:
+        response = session.post(url, data=data, timeout=30)
+        if response.status_code != 200:
+            error = f"HTTP {response.status_code}"
+    except requests.RequestException as e:
+        error = type(e).__name__
+    results.add(kind, time.monotonic() - scheduled, error)
+
+
+def run(url, traffic, args):
+    """sends callbacks until --duration or --requests is reached"""
+    results = Results()
+    local = threading.local()
+
+    def worker(scheduled):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        send_callback(local.session, url, traffic, results, scheduled)
+
+    started = time.monotonic()
+    deadline = started + args.duration if args.duration else None
+
+    def more(sent):
+        if args.requests and sent >= args.requests:
+            return False
+        return deadline is None or time.monotonic() < deadline
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        if args.rate:
+            sent = 0
+            next_arrival = started
+            while more(sent):
+                next_arrival += random.expovariate(args.rate)
+                time.sleep(max(0, next_arrival - time.monotonic()))
+                pool.submit(worker, next_arrival)
+                sent += 1
+        else:
+            counter = {"sent": 0}
+            counter_lock = threading.Lock()
+
+            def closed_loop():
+                while True:
+                    with counter_lock:
+                        if not more(counter["sent"]):
+                            return
+                        counter["sent"] += 1
+                    worker(time.monotonic())
+
+            for _ in range(args.concurrency):
+                pool.submit(closed_loop)
+
+    return results, time.monotonic() - started
+
+
+def percentile(values, percent):
+    if not values:
+        return 0
+    index = max(0, int(round(percent / 100 * len(values))) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def report(results, elapsed, gateway, args):
+    """prints the summary and returns the list of failed gate checks"""
+    latencies = sorted(results.latencies)
+    error_latencies = sorted(results.error_latencies)
+    total = len(latencies)
+    succeeded = total - len(error_latencies)
+    throughput = succeeded / elapsed if elapsed else 0
+    error_rate = (total - succeeded) / total if total else 0
+    p99 = percentile(latencies, 99) * 1000
+
+    print(f"requests:    {total} in {elapsed:.1f}s")
+    print(f"throughput:  {throughput:.1f} processed sms/s")
+    print(
+        "latency ms:  "
+        + "  ".join(
+            f"p{p}={percentile(latencies, p) * 1000:.0f}" for p in (50, 90, 95, 99)
+        )
+        + f"  max={(latencies[-1] * 1000 if latencies else 0):.0f}"
+    )
+    print(f"errors:      {error_rate:.2%} {dict(results.errors)}")
+    if error_latencies:
+        print(
+            "error ms:    "
+            + f"p50={percentile(error_latencies, 50) * 1000:.0f}"
+            + f"  max={error_latencies[-1] * 1000:.0f}"
+        )
+    print(f"serial mix:  {dict(results.kinds)}")
+    if gateway is not None:
+        print(f"gateway:     {gateway.sent} sms sent for {succeeded} callbacks")
+
+    failed = []
+    if args.min_throughput is not None and throughput < args.min_throughput:
+        failed.append(f"throughput {throughput:.1f} < {args.min_throughput}")
+    if args.max_p99 is not None and p99 > args.max_p99:
+        failed.append(f"p99 {p99:.0f}ms > {args.max_p99}ms")
+    if args.max_error_rate is not None and error_rate > args.max_error_rate:
+        failed.append(f"error rate {error_rate:.2%} > {args.max_error_rate:.2%}")
+    return failed
+
+
+def parse_mix(value):
+    """'OK=70,FAILURE=10,DOUBLE=5,NOT-FOUND=15' -> {kind: weight}"""
+    mix = {}
+    for part in value.split(","):
+        kind, weight = part.split("=")
+        mix[kind.strip().upper()] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rate", type=float, default=20, help="arrivals per second")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, help="seconds, 30 by default")
+    parser.add_argument("--requests", type=int, help="stop after this many")
+    parser.add_argument(
+        "--mix", type=parse_mix, default="OK=70,FAILURE=10,DOUBLE=5,NOT-FOUND=15"
+    )
+    parser.add_argument("--senders", type=int, default=200)
+    parser.add_argument("--app-port", type=int, default=5001)
+    parser.add_argument("--server", choices=("dev", "uwsgi"), default="dev")
+    parser.add_argument("--gateway-port", type=int, default=5002)
+    parser.add_argument(
+        "--gateway-delay", type=float, default=0.05, help="seconds per sms"
+    )
+    parser.add_argument(
+        "--target", help="base url of an already running app, nothing is started"
+    )
+    parser.add_argument("--min-throughput", type=float)
+    parser.add_argument("--max-p99", type=float, help="milliseconds")
+    parser.add_argument("--max-error-rate", type=float, help="0.01 for 1%%")
+    args = parser.parse_args()
+    if not args.requests and not args.duration:
+        args.duration = 30
+
+    traffic = Traffic(sample_serials(), args.mix, args.senders)
+
+    gateway = app = None
+    if args.target:
+        base_url = args.target.rstrip("/")
+    else:
+        gateway = MockGateway(args.gateway_port, args.gateway_delay)
+        threading.Thread(target=gateway.serve_forever, daemon=True).start()
+        app = start_app(
+            args.app_port, f"http://127.0.0.1:{args.gateway_port}/", args.server
+        )
+        base_url = f"http://127.0.0.1:{args.app_port}"
+
+    try:
+        results, elapsed = run(
+            f"{base_url}/v1/{CALL_BACK_TOKEN}/process", traffic, args
+        )
+    finally:
+        if app is not None:
+            app.terminate()
+            app.wait()
+        if gateway is not None:
+            gateway.shutdown()
+
+    failed = report(results, elapsed, gateway, args)
+    for failure in failed:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
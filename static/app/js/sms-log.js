@@ -0,0 +1,48 @@
+// SMS History table: pages are loaded lazily from /v1/sms_log
+$(document).ready(function() {
+    // cells are filled from user supplied SMS text, so render it as text, not html
+    const text = $.fn.dataTable.render.text();
+    const table = $('#dataTable').DataTable({
+        order: [],
+        columns: [
+            { data: 'status', render: text },
+            { data: 'sender', render: text },
+            { data: 'message', render: text, className: 'text-center', createdCell: td => $(td).css('direction', 'rtl') },
+            { data: 'answer', render: text, className: 'text-right', createdCell: td => $(td).css('direction', 'rtl') },
+            { data: 'date', render: text }
+        ]
+    });
+    const more = $('#smsLogMore');
+    let filters = '';
+    let next = null;
+
+    function loadPage() {
+        let url = '/v1/sms_log?' + filters;
+        if (next) {
+            url += '&cursor=' + encodeURIComponent(next);
+        }
+        more.prop('disabled', true);
+        $.getJSON(url, function(page) {
+            table.rows.add(page.smss).draw(false);
+            next = page.next;
+            more.toggle(next !== null);
+        }).always(function() {
+            more.prop('disabled', false);
+        });
+    }
+
+    $('#smsLogFilters').on('submit', function(event) {
+        event.preventDefault();
+        filters = $(this).find(':input').filter(function() {
+            return this.value;
+        }).serialize();
+        next = null;
+        $('#smsLogExport').attr('href', '/export/sms?' + filters);
+        $('#smsLogExportGzip').attr('href', '/export/sms?format=gzip&' + filters);
+        table.clear().draw();
+        loadPage();
+    });
+    more.on('click', loadPage);
+
+    loadPage();
+});
@@ -0,0 +1,14 @@
+import os
+import sys
+
+# main.py reads these at import time
+os.environ.setdefault("UPLOAD_FOLDER", "/tmp")
+os.environ.setdefault("ALLOWED_EXTENSIONS", "xlsx")
+os.environ.setdefault("API_KEY", "test")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("CALL_BACK_TOKEN", "test")
+os.environ.setdefault("PASSWORD", "test")
+os.environ.setdefault("USERNAME", "test")
+os.environ.setdefault("IMPORT_WORKER", "false")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))